@@ -0,0 +1,127 @@
+"""Shared AQI helpers and the cached data loader for the air quality pages.
+
+Keeping load_data here means every page that imports it shares a single Streamlit cache
+entry, so the dataset is read and held in memory only once per process.
+"""
+import contextlib
+import os
+
+import pandas as pd
+import streamlit as st
+import numpy as np
+import pyarrow as pa
+from pyarrow import csv as pacsv
+
+# Order of the US EPA health categories and their discrete colors (legend order and color map for Plotly)
+CATEGORY_ORDER = ['Good', 'Moderate', 'Unhealthy for Sensitive Groups', 'Unhealthy', 'Very Unhealthy', 'Hazardous']
+COLOR_MAP = dict(zip(CATEGORY_ORDER, ['#009966', '#ffde33', '#ff9933', '#cc0033', '#660099', '#7e0023']))
+
+# Vectorized AQI band lookup: upper bound (inclusive) of each category but the last, then labels/colors
+AQI_EDGES = np.array([50, 100, 150, 200, 300], dtype=np.int32)
+_AQI_LABELS = np.array(CATEGORY_ORDER)
+_AQI_COLORS = np.array(list(COLOR_MAP.values()))
+
+def aqi_band_index(aqi):
+    """Maps each AQI value in the array to the index of its health category in CATEGORY_ORDER."""
+    return np.searchsorted(AQI_EDGES, aqi, side='left')
+
+# Source CSV and the explicit Arrow column types used when parsing it (skips type inference)
+# Dates stay strings here so they are parsed with their explicit formats below
+CSV_PATH = 'AQI_Thailand_FINAL_DATA_20251207_142243.csv'
+# Part of the Parquet cache filename; bump whenever _read_cleaned changes what it builds, so caches
+# written by older code are rebuilt instead of reused
+PARQUET_CACHE_VERSION = 2
+# float32 for pollutants/coordinates, int16 for AQI (US EPA AQI <= 500); station and record type
+# repeat across many rows, so they are dictionary-encoded and arrive as pandas categoricals
+# (equality filters then compare int codes instead of Python strings)
+CSV_COLUMN_TYPES = {
+    'aqi_overall': pa.int16(),
+    'pm25': pa.float32(),
+    'pm10': pa.float32(),
+    'o3': pa.float32(),
+    'temp': pa.float32(),
+    'humidity': pa.float32(),
+    'latitude': pa.float32(),
+    'longitude': pa.float32(),
+    'city_name': pa.dictionary(pa.int32(), pa.string()),
+    'record_type': pa.dictionary(pa.int32(), pa.string()),
+    'record_date': pa.string(),
+    'time_utc': pa.string(),
+}
+
+# Called only from _read_data, which runs once per process (see load_data)
+def _read_cleaned(csv_path):
+    """Returns the cleaned records, from the Parquet cache next to the CSV or by (re)building it."""
+    parquet_path = f"{os.path.splitext(csv_path)[0]}.v{PARQUET_CACHE_VERSION}.parquet"
+    # Columnar Parquet load unless the CSV has been modified since this cache version was written;
+    # the dtypes and cleanup were fixed when the file was built
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path):
+        return pd.read_parquet(parquet_path, engine='pyarrow')
+
+    # pyarrow's multi-threaded C++ parser; dictionary columns arrive in pandas as categoricals.
+    # Its default null values ('N/A', '', 'NaN', 'NA', 'null', ...) make the 'N/A' cells nulls,
+    # including in the integer aqi_overall column
+    table = pacsv.read_csv(csv_path, convert_options=pacsv.ConvertOptions(column_types=CSV_COLUMN_TYPES))
+    df = table.to_pandas()
+
+    # Convert date/time columns to proper datetime objects.
+    # errors='coerce' turns invalid parsing (like 'N/A') into NaT (Not a Time/Date)
+    # The CSV uses fixed formats, so pass them explicitly to skip per-value format inference
+    # record_date is floored to midnight (datetime64, not datetime.date objects) so date comparisons
+    # run as integer array compares; pandas stores the datetime64[D] result at second resolution
+    df['record_date'] = pd.to_datetime(df['record_date'], format='%Y-%m-%d', errors='coerce').values.astype('datetime64[D]')
+    df['time_utc'] = pd.to_datetime(df['time_utc'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+
+    # Clean 'aqi_overall' by filling the 'N/A' nulls (from Past data rows) with 0
+    df['aqi_overall'] = df['aqi_overall'].fillna(0).astype('int16')
+
+    # Write to a temporary file and move it into place, so an interrupted write never leaves a
+    # truncated cache newer than the CSV. The cache is optional: if the directory is not writable,
+    # just use the frame parsed above
+    tmp_path = parquet_path + '.tmp'
+    try:
+        df.to_parquet(tmp_path, engine='pyarrow', compression='zstd')
+        os.replace(tmp_path, parquet_path)
+    except OSError:
+        # Best-effort cleanup; a leftover temporary file is never read
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+    return df
+
+def _read_data(csv_path):
+    """Loads, cleans, and prepares ALL air quality data records (Current and Past), plus summary metadata."""
+    df = _read_cleaned(csv_path)
+
+    # Stations are listed (station dropdown, meta['cities']) in the order they first appear in the
+    # CSV, regardless of which category order the parser or cache produced
+    codes = df['city_name'].cat.codes.to_numpy()
+    first_seen = pd.unique(codes[codes >= 0])
+    df['city_name'] = df['city_name'].cat.set_categories(df['city_name'].cat.categories[first_seen])
+
+    # Look up every row's AQI band in one binary search to create the coloring/display columns
+    idx = aqi_band_index(df['aqi_overall'].to_numpy())
+    df['aqi_category'] = pd.Categorical.from_codes(idx, categories=_AQI_LABELS)
+    df['color_code'] = _AQI_COLORS[idx]
+
+    # Summary values the sidebar needs on every rerun; df never changes, so compute them only once
+    # (np.float32 keeps the PM2.5 widget bounds exactly on the float32 values stored in the column)
+    meta = {
+        'pm25_min': float(np.float32(df['pm25'].min())),
+        'pm25_max': float(np.float32(df['pm25'].max())),
+        'min_date': df['record_date'].min().date(),
+        'max_date': df['record_date'].max().date(),
+        'cities': df['city_name'].cat.categories.tolist(),
+    }
+    return df, meta
+
+# Use st.cache_resource to load the data only once for performance. Unlike st.cache_data it hands
+# every rerun the same DataFrame instead of a fresh copy; this is safe because nothing mutates df
+# (all filtering builds new frames via compute_mask + take)
+@st.cache_resource
+def load_data():
+    """Returns the prepared air quality records and their summary metadata as (df, meta)."""
+    try:
+        return _read_data(CSV_PATH)
+    except FileNotFoundError:
+        st.error(f"Error: The file '{CSV_PATH}' was not found. Please ensure it is in the same directory.")
+        st.stop()
@@ -2,57 +2,94 @@ import pandas as pd
 import streamlit as st
 import plotly.express as px
 import numpy as np
+import numexpr as ne
+
+from _aqi_core import CATEGORY_ORDER, COLOR_MAP, load_data
 
 # --- 1. Basic Setup, Data Loading, and Helper Functions ---
 
 # Set the page configuration for a wider layout
 st.set_page_config(layout="wide", page_title="Current Air Quality Map")
 
-# Helper function to map AQI score to a descriptive health category and color
-def aqi_category(aqi):
-    """Maps AQI score to a descriptive health category and color (based on US EPA standard)."""
-    # Ensure AQI is an integer for accurate comparison
-    aqi = int(aqi)
-    if aqi <= 50:
-        return 'Good', '#009966'
-    elif aqi <= 100:
-        return 'Moderate', '#ffde33'
-    elif aqi <= 150:
-        return 'Unhealthy for Sensitive Groups', '#ff9933'
-    elif aqi <= 200:
-        return 'Unhealthy', '#cc0033'
-    elif aqi <= 300:
-        return 'Very Unhealthy', '#660099'
-    else: # > 300
-        return 'Hazardous', '#7e0023'
-
-# Use st.cache_data to load the CSV only once for performance
-@st.cache_data
-def load_data():
-    """Loads, cleans, and prepares ALL air quality data records (Current and Past)."""
-    file_path = 'AQI_Thailand_FINAL_DATA_20251207_142243.csv'
-    try:
-        df = pd.read_csv(file_path)
-        
-        # Convert date/time columns to proper datetime objects.
-        # errors='coerce' turns invalid parsing (like 'N/A') into NaT (Not a Time/Date)
-        # .dt.date is used for record_date to strip the time part for clean date filtering
-        df['record_date'] = pd.to_datetime(df['record_date'], errors='coerce').dt.date
-        df['time_utc'] = pd.to_datetime(df['time_utc'], errors='coerce')
-        
-        # Clean 'aqi_overall' by replacing 'N/A' (from Past data rows) with 0 before converting to integer
-        df['aqi_overall'] = df['aqi_overall'].replace('N/A', 0).astype(int)
-        
-        # Apply the helper function to create new columns for coloring/display
-        df[['aqi_category', 'color_code']] = df['aqi_overall'].apply(
-            lambda x: pd.Series(aqi_category(x))
+# Date of the "Current" snapshot in the dataset
+CURRENT_DATE = pd.to_datetime('2025-12-07').date()
+
+def _category_code(series, value):
+    """Returns the categorical code of value in series, or -1 (matches no row) if it is not a category."""
+    categories = series.cat.categories
+    return categories.get_loc(value) if value in categories else -1
+
+def compute_mask(df, show_current=False, date=None, city=None, pm_lo=None, pm_hi=None):
+    """Combines the sidebar filters into a single boolean row mask; filters left as None are skipped."""
+    mask = np.ones(len(df), dtype=bool)
+    if show_current:
+        mask &= df['record_type'].cat.codes.to_numpy() == _category_code(df['record_type'], 'Current')
+    if date is not None:
+        mask &= df['record_date'].to_numpy() == np.datetime64(date, 'D')
+    if city is not None and city != 'All Stations':
+        mask &= df['city_name'].cat.codes.to_numpy() == _category_code(df['city_name'], city)
+    if pm_lo is not None and pm_hi is not None:
+        # numexpr evaluates both comparisons and the ANDs in a single pass over the column
+        mask = ne.evaluate(
+            'mask & (pm >= lo) & (pm <= hi)',
+            local_dict={'mask': mask, 'pm': df['pm25'].to_numpy(), 'lo': pm_lo, 'hi': pm_hi},
         )
-        return df
-    except FileNotFoundError:
-        st.error(f"Error: The file '{file_path}' was not found. Please ensure it is in the same directory.")
-        st.stop()
+    return mask
+
+# Cap on the rows sent to the browser for the data table (keeps the Arrow payload small)
+MAX_TABLE_ROWS = 2000
+
+# Columns shown in the filtered data table
+TABLE_COLUMNS = ['record_type', 'city_name', 'record_date', 'time_utc', 'aqi_overall', 'aqi_category', 'pm25', 'pm10', 'o3', 'temp', 'humidity']
+
+# Cap on cached figures/table slices; each distinct filter combination adds an entry
+FILTER_CACHE_ENTRIES = 64
+
+# The leading underscore tells st.cache_data not to hash the frame; it is fully
+# determined by filter_key (the sidebar selections), which is the cache key
+@st.cache_data(show_spinner=False, max_entries=FILTER_CACHE_ENTRIES)
+def build_map(_df_filtered, filter_key, per_station=False):
+    """Builds the AQI scatter_mapbox figure for the filtered records."""
+    plot_df = _df_filtered
+    if per_station:
+        # Keep each station's worst real record (highest AQI) so the marker shows actual readings
+        # and agrees with the Maximum AQI summary; the stable sort keeps the first row on ties,
+        # matching the summary's argmax
+        order = np.argsort(-_df_filtered['aqi_overall'].to_numpy(dtype=np.int32), kind='stable')
+        plot_df = _df_filtered.take(order).drop_duplicates('city_name')
+
+    # Create the scatter_mapbox figure using Plotly Express
+    fig = px.scatter_mapbox(
+        plot_df,
+        lat="latitude",
+        lon="longitude",
+        color="aqi_category",              # Color the points by the category string
+        size="pm25",                       # Size the points by PM2.5 concentration
+        hover_name="city_name",
+        hover_data={
+            "pm25": ':.1f',
+            "aqi_overall": True,
+            "aqi_category": True,          # Include category in tooltip
+            "record_type": True,           # Whether the marker shows a Current or Forecast record
+            "latitude": False,
+            "longitude": False,
+            "temp": ':.1f',
+        },
+        category_orders={"aqi_category": CATEGORY_ORDER}, # Ensures the legend is in the correct order
+        color_discrete_map=COLOR_MAP,      # Use the discrete color mapping
+        zoom=5, 
+        height=600,
+    )
     
-df = load_data()
+    # Update map style and layout
+    fig.update_layout(mapbox_style="open-street-map")
+    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=FILTER_CACHE_ENTRIES)
+def table_slice(_df_filtered, filter_key):
+    """Projects the first MAX_TABLE_ROWS filtered records onto the columns shown in the data table."""
+    return _df_filtered.head(MAX_TABLE_ROWS)[TABLE_COLUMNS]
 
 # --- 2. Title and Sidebar ---
 
@@ -60,41 +97,40 @@ st.title("🗺️ Current Air Quality Index (AQI) Across Stations")
 st.markdown("Visualize the real-time AQI and specific pollutant levels across monitoring stations.")
 st.sidebar.header("Filter & View Options")
 
+# Loaded after the page chrome above so the title and sidebar header paint first
+df, meta = load_data()
+
 # --- 3. Sidebar Filtering (Interactivity) ---
 
 # --- Record Type Toggle ---
 st.sidebar.subheader("Record Type")
 
-# Initialize df_filtered with the full dataset copy
-df_filtered = df.copy()
-
 # Checkbox for "Current" data only
 show_current_only = st.sidebar.checkbox("Current (12-7-2025) (Not including forecasts)", value=False, help="Show only current data from 2025-12-07")
 
-# Apply Current filter if checkbox is checked
-if show_current_only:
-    df_filtered = df_filtered[df_filtered['record_type'] == 'Current']
+# Rows left by the record type toggle alone (used for the date picker defaults)
+type_mask = compute_mask(df, show_current=show_current_only)
 
 st.sidebar.markdown("---")
 st.sidebar.subheader("Date")
 
 # Calculate overall min/max dates for picker limits
-max_date_overall = df['record_date'].max()
-min_date_overall = df['record_date'].min()
+max_date_overall = meta['max_date']
+min_date_overall = meta['min_date']
 
-# Calculate min/max dates from the currently filtered data (for initial value)
-min_date_filtered = df_filtered['record_date'].min()
-max_date_filtered = df_filtered['record_date'].max()
+# Calculate min/max dates from the record type selection (for initial value)
+dates_filtered = df['record_date'][type_mask]
+min_date_filtered = dates_filtered.min()
+max_date_filtered = dates_filtered.max()
 
 # Handle edge case where filtered data is empty
 if pd.isna(min_date_filtered):
     st.sidebar.warning("No data available for the selected record type.")
     min_date_filtered = pd.to_datetime('today').date()
     max_date_filtered = pd.to_datetime('today').date()
-
-# Store initial filtered date for session
-if 'initial_date' not in st.session_state:
-    st.session_state['initial_date'] = max_date_filtered
+else:
+    min_date_filtered = min_date_filtered.date()
+    max_date_filtered = max_date_filtered.date()
 
 # Single Date selector (not a range)
 selected_date = st.sidebar.date_input(
@@ -102,38 +138,29 @@ selected_date = st.sidebar.date_input(
     value=max_date_filtered,
     min_value=min_date_overall,
     max_value=max_date_overall,
-    disabled=df_filtered.empty or show_current_only,
+    disabled=not type_mask.any() or show_current_only,
     key='date_input'
 )
 
-# Apply the Date Filter Logic (single-date)
-if not df_filtered.empty:
-    # If "Current" is checked, use only 2025-12-07
-    if show_current_only:
-        current_date = pd.to_datetime('2025-12-07').date()
-        df_filtered = df_filtered[df_filtered['record_date'] == current_date]
-    else:
-        # Filter to the single selected date
-        df_filtered = df_filtered[df_filtered['record_date'] == selected_date]
+# Date Filter Logic (single-date): if "Current" is checked, use only 2025-12-07
+filter_date = CURRENT_DATE if show_current_only else selected_date
+date_mask = compute_mask(df, show_current=show_current_only, date=filter_date)
 
 st.sidebar.markdown("---")
 st.sidebar.subheader("Location & Pollutant Filters")
 
-# Selector for City/Station (This uses df_filtered now)
-city_names = ['All Stations'] + df_filtered['city_name'].unique().tolist()
+# Selector for City/Station (only stations left after the record type and date filters)
+# Computed from the categorical codes, not the strings
+city_names = ['All Stations'] + df['city_name'][date_mask].cat.remove_unused_categories().cat.categories.tolist()
 selected_city = st.sidebar.selectbox(
     'Select Station Location',
     city_names
 )
 
-# Apply City Filter
-if selected_city != 'All Stations':
-    df_filtered = df_filtered[df_filtered['city_name'] == selected_city]
-
 # Slider for Pollutant Threshold
 # Note: min/max values are taken from the overall df to avoid filter cascade issues
-pm25_min_overall = float(df['pm25'].min())
-pm25_max_overall = float(df['pm25'].max())
+pm25_min_overall = meta['pm25_min']
+pm25_max_overall = meta['pm25_max']
 
 # --- MODIFIED: Combined PM2.5 Range Slider ---
 pm25_range = st.sidebar.slider(
@@ -149,21 +176,32 @@ pm25_range = st.sidebar.slider(
 pm25_min_threshold = pm25_range[0]
 pm25_max_threshold = pm25_range[1]
 
-# Apply PM2.5 filters
-df_filtered = df_filtered[
-    (df_filtered['pm25'] >= pm25_min_threshold) &
-    (df_filtered['pm25'] <= pm25_max_threshold)
-].reset_index(drop=True)
+# Apply all filters at once: one fused mask, then a single row selection by index array
+# (the selected rows are materialized once; the index is renumbered in place rather than copied again)
+mask = compute_mask(
+    df,
+    show_current=show_current_only,
+    date=filter_date,
+    city=selected_city,
+    pm_lo=pm25_min_threshold,
+    pm_hi=pm25_max_threshold,
+)
+df_filtered = df.take(np.flatnonzero(mask))
+df_filtered.index = pd.RangeIndex(len(df_filtered))
+
+# Cache key for everything derived from df_filtered (the map figure and table slice)
+filter_key = (show_current_only, filter_date, selected_city, pm25_range)
 
 # --- 4. Key Summary Metrics ---
 
 st.subheader("Key Air Quality Summary")
 
 if not df_filtered.empty:
-    # Calculate the maximum AQI and its corresponding station
-    max_aqi = df_filtered['aqi_overall'].max()
-    # Handle cases where multiple stations have the max AQI, just take the first one
-    worst_station = df_filtered[df_filtered['aqi_overall'] == max_aqi]['city_name'].iloc[0]
+    # Calculate the maximum AQI and its corresponding station in a single pass
+    # argmax returns the first position on ties, so multiple stations with the max AQI yield the first one
+    idx = df_filtered['aqi_overall'].to_numpy(copy=False).argmax()
+    max_aqi = df_filtered['aqi_overall'].iat[idx]
+    worst_station = df_filtered['city_name'].iat[idx]
 
     # Display metrics in columns
     col1, col2, col3 = st.columns(3)
@@ -191,36 +229,12 @@ st.header("Air Quality Map (Color by Health Category)")
 # Check if there's data to plot after filtering
 if not df_filtered.empty:
     
-    # Define the order and discrete color map for Plotly
-    category_order = ['Good', 'Moderate', 'Unhealthy for Sensitive Groups', 'Unhealthy', 'Very Unhealthy', 'Hazardous']
-    # Create the color map dictionary for Plotly
-    color_map = {cat: aqi_category(i * 51)[1] for i, cat in enumerate(category_order)} 
-    
-    # Create the scatter_mapbox figure using Plotly Express
-    fig = px.scatter_mapbox(
-        df_filtered,
-        lat="latitude",
-        lon="longitude",
-        color="aqi_category",              # Color the points by the category string
-        size="pm25",                       # Size the points by PM2.5 concentration
-        hover_name="city_name",
-        hover_data={
-            "pm25": ':.1f',
-            "aqi_overall": True,
-            "aqi_category": True,          # Include category in tooltip
-            "latitude": False,
-            "longitude": False,
-            "temp": ':.1f',
-        },
-        category_orders={"aqi_category": category_order}, # Ensures the legend is in the correct order
-        color_discrete_map=color_map,      # Use the discrete color mapping
-        zoom=5, 
-        height=600,
-    )
-    
-    # Update map style and layout
-    fig.update_layout(mapbox_style="open-street-map")
-    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    # Several records can share a station (Current and Forecast rows for the same date);
+    # plot one marker per station instead of stacking overlapping markers
+    per_station = bool(df_filtered['city_name'].duplicated().any())
+
+    # Reuse the cached figure when the filter selections are unchanged
+    fig = build_map(df_filtered, filter_key, per_station)
     
     # Display the Plotly chart in Streamlit
     st.plotly_chart(fig, use_container_width=True)
@@ -229,17 +243,20 @@ if not df_filtered.empty:
 else:
     st.warning("No stations match the selected filter criteria. Try changing the record type toggle or reducing the minimum PM2.5 threshold.")
 
-# --- 6. Data Table Preview (Enhanced with st.data_editor) ---
+# --- 6. Data Table Preview (Enhanced with st.dataframe) ---
 
 st.markdown("---")
 st.header("Filtered Data Table")
 st.caption(f"Showing {len(df_filtered)} of {len(df)} total records (before record type filter).")
 
 if not df_filtered.empty:
-    # Use st.data_editor for interactive table experience
-    st.data_editor(
+    if len(df_filtered) > MAX_TABLE_ROWS:
+        st.caption(f"Displaying first {MAX_TABLE_ROWS} rows for performance.")
+
+    # Use st.dataframe for interactive table experience (read-only, lighter than st.data_editor)
+    st.dataframe(
         # CRITICAL CHANGE: Added 'record_date' and included 'record_type' for clarity
-        df_filtered[['record_type', 'city_name', 'record_date', 'time_utc', 'aqi_overall', 'aqi_category', 'pm25', 'pm10', 'o3', 'temp', 'humidity']],
+        table_slice(df_filtered, filter_key),
         
         # Using NumberColumn for AQI and PM2.5 to avoid the Progress compatibility error
         column_config={
@@ -248,6 +265,7 @@ if not df_filtered.empty:
                 format="%d",
             ),
             "pm25": st.column_config.NumberColumn("PM2.5", format="%.1f µg/m³"),
+            "record_date": st.column_config.DateColumn("record_date"),
             "city_name": "Station Location",
             "aqi_category": "Health Category"
         },